@@ -8,7 +8,12 @@ Intcode program overview:
    - 2: Multiply values of next 2 index's values, total stored in position indiciated by 3rd integer.
    - 99: Program finish, halt.
 """
+import hashlib
+import mmap
+import os
 import pytest
+import tempfile
+from array import array
 
 test_cases = [
     ([1, 0, 0, 0, 99], [2, 0, 0, 0, 99]),
@@ -23,12 +28,59 @@ def test_intcode(input, output):
     assert parse_intcode(input) == output
 
 
-def read_intcode(intcode_file):
-    intcode = []
-    with open(intcode_file, "r") as int_f:
-        intcode = int_f.read().split(",")
+def test_solve_noun_verb():
+    # Every address from 12 up holds its own index, so the output is 2 * (noun + verb)
+    intcode = [1, 0, 0, 3, 2, 3, 11, 0, 99, 0, 0, 2] + list(range(12, 100))
+    assert solve_noun_verb(intcode, 100, nouns=range(12, 100), verbs=range(12, 100)) == (12, 38)
+
+
+# Program images read so far, keyed by (path, mtime, size) of their file, so the part 1 and
+# part 2 solvers only parse the input once
+program_images = {}
+
+
+def load_image(program_file, cache_dir=None):
+    """
+    Parse a comma separated Intcode program into an int64 image, once. The image is cached on disk
+    in cache_dir (by default a directory in the system temp dir) keyed by the hash of the file's
+    content and memory-mapped when loaded again, and kept in this process so loading an unchanged
+    file again only costs a stat. Programs with values beyond int64 are returned as a plain list.
+
+    The image is shared and read-only, read_intcode hands out a list copy of it.
+    """
+    stat = os.stat(program_file)
+    key = (os.path.abspath(program_file), stat.st_mtime_ns, stat.st_size)
+    if key in program_images:
+        return program_images[key]
+
+    with open(program_file, "rb") as int_f:
+        text = int_f.read()
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "intcode-images")
+    image_file = os.path.join(cache_dir, f"{hashlib.sha256(text).hexdigest()}.q")
+
+    # A cached image is only trusted if it holds exactly one int64 per value of the program
+    if os.path.exists(image_file) and os.path.getsize(image_file) == 8 * (text.count(b",") + 1):
+        with open(image_file, "rb") as image_f:
+            image = memoryview(mmap.mmap(image_f.fileno(), 0, access=mmap.ACCESS_READ)).cast("q")
+    else:
+        values = list(map(int, text.split(b",")))
+        try:
+            image = array("q", values)
+        except OverflowError:
+            image = values
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(f"{image_file}.{os.getpid()}", "wb") as image_f:
+                image.tofile(image_f)
+            os.replace(f"{image_file}.{os.getpid()}", image_file)
+
+    program_images[key] = image
+    return image
+
 
-    return list(map(int, intcode))
+def read_intcode(intcode_file):
+    return list(load_image(intcode_file))
 
 
 def parse_intcode(intcode):
@@ -64,16 +116,79 @@ def intcode_executor(intcode_file, noun, verb):
     return processed_intcode[0]
 
 
+def run_noun_verb(intcode, noun, verb):
+    intcode = list(intcode)
+    intcode[1] = noun
+    intcode[2] = verb
+
+    return parse_intcode(intcode)[0]
+
+
 def brute_force_intcode(intcode_file, expected_value):
+    intcode = read_intcode(intcode_file)
     for noun in range(99):
         for verb in range(99):
-            result = intcode_executor(intcode_file, noun, verb)
+            result = run_noun_verb(intcode, noun, verb)
             if result == expected_value:
                 return noun, verb
 
     return None
 
 
-print(intcode_executor("./input", 12, 2))
+def solve_noun_verb(intcode, expected_value, nouns=range(100), verbs=range(100)):
+    """
+    Find a (noun, verb) pair producing expected_value from a program that is already loaded.
+
+    The gravity assist program computes a + b * noun + c * verb, so probe a few points to
+    fit and check that, then solve for the verb from each noun directly. Falls back to
+    trying every pair if the output turns out not to be affine.
+    """
+    def run(noun, verb):
+        try:
+            return run_noun_verb(intcode, noun, verb)
+        except (IndexError, ValueError):
+            return None
+
+    base = run(nouns[0], verbs[0])
+    noun_step = run(nouns[0] + 1, verbs[0])
+    verb_step = run(nouns[0], verbs[0] + 1)
+
+    def affine(noun, verb):
+        return base + noun_step * (noun - nouns[0]) + verb_step * (verb - verbs[0])
+
+    probes = [
+        (nouns[-1], verbs[0]),
+        (nouns[0], verbs[-1]),
+        (nouns[-1], verbs[-1]),
+        (nouns[len(nouns) // 2], verbs[len(verbs) // 2]),
+    ]
+    if None not in (base, noun_step, verb_step):
+        noun_step -= base
+        verb_step -= base
+        if all(run(noun, verb) == affine(noun, verb) for noun, verb in probes):
+            for noun in nouns:
+                remainder = expected_value - affine(noun, verbs[0])
+                if verb_step == 0:
+                    candidates = [verbs[0]] if remainder == 0 else []
+                elif remainder % verb_step == 0 and verbs[0] + remainder // verb_step in verbs:
+                    candidates = [verbs[0] + remainder // verb_step]
+                else:
+                    candidates = []
+
+                # Guard against a non-affine program that happened to fit the probes
+                for verb in candidates:
+                    if run(noun, verb) == expected_value:
+                        return noun, verb
+
+    for noun in nouns:
+        for verb in verbs:
+            if run(noun, verb) == expected_value:
+                return noun, verb
+
+    return None
+
+
+if __name__ == "__main__":
+    print(intcode_executor("./input", 12, 2))
 
-print(brute_force_intcode("./input", 19690720))
+    print(solve_noun_verb(read_intcode("./input"), 19690720))
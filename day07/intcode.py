@@ -26,8 +26,14 @@ Intcode program overview:
         - 1 = immediate mode (use the parameter value as it is)
         - 0 = position mode (parameter value is a position to the requested value)
 """
+import hashlib
+import mmap
+import os
 import pytest
 import sys
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from itertools import permutations
 
 test_cases = [
@@ -41,15 +47,98 @@ test_cases = [
 
 @pytest.mark.parametrize("input, output", test_cases)
 def test_intcode(input, output):
-    assert parse_intcode(input) == output
+    assert parse_intcode(input, [])[1] == output
 
 
-def read_intcode(intcode_file):
-    intcode = []
-    with open(intcode_file, "r") as int_f:
-        intcode = int_f.read().split(",")
+def test_pause_on_input():
+    intcode = [3, 15, 3, 16, 1002, 16, 10, 16, 1, 16, 15, 15, 4, 15, 99, 0, 0]
+    output, intcode, index = parse_intcode(intcode, [4], pause_on_input=True)
+    assert (output, index) == ([], 2)
+
+    output, intcode, index = parse_intcode(intcode, [0], index=index, pause_on_input=True)
+    assert (output, index) == ([4], -1)
+
+
+search_test_cases = [
+    ([3, 15, 3, 16, 1002, 16, 10, 16, 1, 16, 15, 15, 4, 15, 99, 0, 0], [0, 1, 2, 3, 4], False, (4, 3, 2, 1, 0), 43210),
+    (
+        [
+            3, 26, 1001, 26, -4, 26, 3, 27, 1002, 27, 2, 27, 1, 27, 26, 27,
+            4, 27, 1001, 28, -1, 28, 1005, 28, 6, 99, 0, 0, 5,
+        ],
+        [5, 6, 7, 8, 9], True, (9, 8, 7, 6, 5), 139629729,
+    ),
+]
+
+
+@pytest.mark.parametrize("intcode, settings, loopback, best_setting, signal", search_test_cases)
+def test_search_phase_settings(intcode, settings, loopback, best_setting, signal):
+    assert search_phase_settings(intcode, settings, loopback=loopback, workers=2) == (best_setting, signal)
+
+
+def test_search_amplifier_tree():
+    intcode = [3, 15, 3, 16, 1002, 16, 10, 16, 1, 16, 15, 15, 4, 15, 99, 0, 0]
+    runs = {}
+    assert search_amplifier_tree(intcode, [0, 1, 2, 3, 4], runs=runs) == ((4, 3, 2, 1, 0), 43210)
+    # One run per distinct prefix instead of 5 runs for each of the 120 permutations
+    assert len(runs) == 5 + 20 + 60 + 120 + 120
+
+    # Each amplifier does signal * 10 + phase, so that bounds what a prefix can reach
+    def bound(prefix, signal, remaining):
+        return (signal + 1) * 10 ** len(remaining)
+
+    pruned_runs = {}
+    assert search_amplifier_tree(intcode, [4, 3, 2, 1, 0], bound=bound, runs=pruned_runs) == ((4, 3, 2, 1, 0), 43210)
+    assert len(pruned_runs) < len(runs)
+
+
+# Program images read so far, keyed by (path, mtime, size) of their file, so every amplifier
+# chain built from the same input only parses it once
+program_images = {}
+
+
+def load_image(program_file, cache_dir=None):
+    """
+    Parse a comma separated Intcode program into an int64 image, once. The image is cached on disk
+    in cache_dir (by default a directory in the system temp dir) keyed by the hash of the file's
+    content and memory-mapped when loaded again, and kept in this process so loading an unchanged
+    file again only costs a stat. Programs with values beyond int64 are returned as a plain list.
+
+    The image is shared and read-only, read_intcode hands out a list copy of it.
+    """
+    stat = os.stat(program_file)
+    key = (os.path.abspath(program_file), stat.st_mtime_ns, stat.st_size)
+    if key in program_images:
+        return program_images[key]
+
+    with open(program_file, "rb") as int_f:
+        text = int_f.read()
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "intcode-images")
+    image_file = os.path.join(cache_dir, f"{hashlib.sha256(text).hexdigest()}.q")
+
+    # A cached image is only trusted if it holds exactly one int64 per value of the program
+    if os.path.exists(image_file) and os.path.getsize(image_file) == 8 * (text.count(b",") + 1):
+        with open(image_file, "rb") as image_f:
+            image = memoryview(mmap.mmap(image_f.fileno(), 0, access=mmap.ACCESS_READ)).cast("q")
+    else:
+        values = list(map(int, text.split(b",")))
+        try:
+            image = array("q", values)
+        except OverflowError:
+            image = values
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(f"{image_file}.{os.getpid()}", "wb") as image_f:
+                image.tofile(image_f)
+            os.replace(f"{image_file}.{os.getpid()}", image_file)
 
-    return list(map(int, intcode))
+    program_images[key] = image
+    return image
+
+
+def read_intcode(intcode_file):
+    return list(load_image(intcode_file))
 
 
 def process_op_code(opcode):
@@ -72,7 +161,12 @@ def process_op_code(opcode):
     return (op_mode, param)
 
 
-def parse_intcode(intcode, input_list, index=0, pause_on_output=False):
+def parse_intcode(intcode, input_list, index=0, pause_on_output=False, pause_on_input=False, verbose=True):
+    """
+    Returns (output, intcode, next index), next index is -1 once the program halts.
+    With pause_on_input, returns at an input instruction instead of prompting when
+    input_list is empty, so calling again with that index resumes there.
+    """
     i = index
     output = []
 
@@ -108,7 +202,8 @@ def parse_intcode(intcode, input_list, index=0, pause_on_output=False):
             next_index += 2
             value_1 = param_value(index + 1, param[0])
             output.append(value_1)
-            print(f"Output: {value_1}")
+            if verbose:
+                print(f"Output: {value_1}")
         elif op == 5:
             value_1 = param_value(index + 1, param[0])
             if value_1 != 0:
@@ -142,6 +237,8 @@ def parse_intcode(intcode, input_list, index=0, pause_on_output=False):
         op_mode, param = process_op_code(intcode[i])
         if op_mode == 99:
             return output, intcode, -1
+        elif op_mode == 3 and pause_on_input and not input_list:
+            return output, intcode, i
         else:
             i = intcode_op(i, op_mode, param)
         if op_mode == 4 and pause_on_output:
@@ -165,12 +262,59 @@ def run_amplifier(program, phase_settings):
     return signal
 
 
+def run_amplifier_chain(intcode, phase_settings, verbose=True):
+    signal = 0
+    for phase in phase_settings:
+        output, _, _ = parse_intcode(list(intcode), [phase, signal], verbose=verbose)
+        signal = output[0]
+
+    return signal
+
+
+def search_amplifier_tree(intcode, settings, bound=None, runs=None):
+    """
+    Walk the phase setting permutation tree depth first, running each amplifier once per
+    distinct prefix since the signal after k amplifiers only depends on the first k phases.
+    Returns (best phase settings, signal).
+
+    bound(prefix, signal, remaining) may give an upper bound on the final signal below a
+    prefix, branches that can't beat the best signal found so far are skipped.
+    runs collects the signal produced for each distinct prefix.
+    """
+    if runs is None:
+        runs = {}
+    best = [None, None]
+
+    def walk(prefix, signal, remaining):
+        if not remaining:
+            if best[1] is None or signal > best[1]:
+                best[0], best[1] = prefix, signal
+            return
+
+        if bound and best[1] is not None and bound(prefix, signal, remaining) <= best[1]:
+            return
+
+        for phase in remaining:
+            next_prefix = prefix + (phase,)
+            if next_prefix not in runs:
+                output, _, _ = parse_intcode(list(intcode), [phase, signal], verbose=False)
+                runs[next_prefix] = output[0]
+            walk(next_prefix, runs[next_prefix], [x for x in remaining if x != phase])
+
+    walk((), 0, list(settings))
+
+    return best[0], best[1]
+
+
 def run_loopback(program, phase_settings):
+    return run_loopback_chain(read_intcode(program), phase_settings)
+
+
+def run_loopback_chain(intcode, phase_settings, verbose=True):
     signal = 0
-    intcode = read_intcode(program)
     amps = len(phase_settings)
 
-    prog_states = [intcode.copy() for _ in range(amps)]
+    prog_states = [list(intcode) for _ in range(amps)]
     index_states = [0] * amps
     input_states = [[x] for x in phase_settings]
     input_states[0].append(0)
@@ -183,6 +327,7 @@ def run_loopback(program, phase_settings):
                 input_list=input_states[i],
                 index=index_states[i],
                 pause_on_output=True,
+                verbose=verbose,
             )
             input_states[i] = []
             prog_states[i] = intcode
@@ -193,15 +338,59 @@ def run_loopback(program, phase_settings):
 
     return last_output
 
+
+# Parsed program shared with each search worker process when the pool starts
+_search_intcode = None
+
+
+def _init_search_worker(intcode):
+    global _search_intcode
+    _search_intcode = intcode
+
+
+def _search_prefix(prefix, settings, loopback):
+    """
+    Best (signal, phase settings) over every permutation starting with prefix.
+    """
+    run_chain = run_loopback_chain if loopback else run_amplifier_chain
+    rest = [x for x in settings if x not in prefix]
+    best = None
+    for tail in permutations(rest):
+        phase_settings = prefix + tail
+        signal = run_chain(_search_intcode, phase_settings, verbose=False)
+        if best is None or signal > best[0]:
+            best = (signal, phase_settings)
+
+    return best
+
+
+def search_phase_settings(intcode, settings, loopback=False, workers=None):
+    """
+    Try every ordering of settings across a process pool and return (best phase settings, signal).
+    The program is parsed once and handed to each worker when it starts. Work is split by
+    the first two phases, so workers generate their own permutations and nothing scales
+    with n! in the parent.
+    """
+    prefix_len = min(2, len(settings))
+    prefixes = list(permutations(settings, prefix_len))
+    tasks = [(prefix, tuple(settings), loopback) for prefix in prefixes]
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_search_worker, initargs=(tuple(intcode),)
+    ) as pool:
+        results = pool.map(_search_prefix, *zip(*tasks))
+        signal, phase_settings = max(results, key=lambda result: result[0])
+
+    return phase_settings, signal
+
+
 if __name__ == "__main__":
     program = "./input"
     if len(sys.argv) > 1:
         program = sys.argv[1]
 
-    output = 0
     possible_settings = [5,6,7,8,9]
-    for phase_settings in permutations(possible_settings):
-        output = max(run_loopback(program, phase_settings), output)
+    phase_settings, output = search_phase_settings(read_intcode(program), possible_settings, loopback=True)
     print(output)
 
     """
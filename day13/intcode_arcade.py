@@ -48,9 +48,18 @@ Intcode program overview:
             - relative base value is changed by opmode 9
 """
 import pytest
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
 import sys
+import tempfile
+import time
+from array import array
+from collections import Counter, deque, namedtuple
 from itertools import permutations
-from collections import Counter
 
 test_cases = [
     ([1, 0, 0, 0, 99], [2, 0, 0, 0, 99]),
@@ -66,13 +75,529 @@ def test_intcode(input, output):
     # assert parse_intcode(input) == output
     pass
 
+
+def test_arcade():
+    # Draws a wall, a block, the paddle and the ball, reads the joystick and scores it plus 10
+    game = [
+        104, 0, 104, 0, 104, 1, 104, 1, 104, 0, 104, 2, 104, 2, 104, 1, 104, 3, 104, 0, 104, 1, 104, 4,
+        3, 100, 104, -1, 104, 0, 1001, 100, 10, 101, 4, 101, 99,
+    ]
+    display = io.StringIO()
+    arcade = Arcade(IntCode(game), display=display)
+    assert arcade.play() == 9
+    assert (arcade.width, arcade.height, arcade.frames) == (3, 2, 2)
+    assert bytes(arcade.screen) == bytes([1, 2, 0, 4, 0, 3])
+    assert arcade.render() == "#~ \no =\nScore: 9"
+    # The second frame only redraws the score
+    assert display.getvalue().count("\x1b[2J") == 1
+    assert display.getvalue().endswith("\x1b[3;1HScore: 9")
+
+class PagedMemory:
+    """
+    Sparse Intcode memory made of fixed size int64 pages, allocated on first write.
+    Reads from untouched pages return 0. A page is promoted to a list of Python ints
+    if a value written to it doesn't fit in int64.
+
+    Memory is conceptually endless zeros, so len() is just the extent of the pages
+    allocated so far and trailing zeros are ignored when comparing.
+
+    Pages may be shared with forked copies; only pages in `writable` are owned by this
+    memory and can be written in place, any other page is copied on its first write.
+
+    Pages hashed by content_hash() are taken out of `writable` while their hash is cached,
+    so the first write to one goes through __setitem__, which drops its hash in O(1); no write
+    needs to update the hash itself. `hash_total` is the sum of the cached hashes and
+    `unhashed` the pages left out of `writable` that have no hash, so content_hash() only
+    visits pages written since its last call. Pages in `watched` are never writable in place,
+    so every write to them goes through __setitem__. `owned` holds the owned pages left out
+    of `writable`.
+    """
+
+    page_bits = 8
+    page_size = 1 << page_bits
+    page_mask = page_size - 1
+    zero_page = array("q", [0] * page_size)
+
+    def __init__(self, values=()):
+        self.pages = {}
+        self.size = 0
+
+        values = list(values)
+        for page_no, start in enumerate(range(0, len(values), self.page_size)):
+            chunk = values[start:start + self.page_size]
+            chunk.extend([0] * (self.page_size - len(chunk)))
+            self.pages[page_no] = self._new_page(chunk)
+            self.size = start + self.page_size
+        self.writable = dict(self.pages)
+        self.page_hashes = {}
+        self.hash_total = 0
+        self.unhashed = set()
+        self.owned = set()
+        self.watched = set()
+
+    @staticmethod
+    def _new_page(values):
+        try:
+            return array("q", values)
+        except OverflowError:
+            return list(values)
+
+    def copy(self):
+        memory = PagedMemory()
+        memory.pages = {page_no: page[:] for page_no, page in self.pages.items()}
+        memory.writable = dict(memory.pages)
+        memory.size = self.size
+        return memory
+
+    def fork(self):
+        memory = PagedMemory()
+        memory.pages = dict(self.pages)
+        memory.size = self.size
+        memory.page_hashes = dict(self.page_hashes)
+        memory.hash_total = self.hash_total
+        # Every page is now shared, so neither side may write to them in place
+        self.unhashed.update(self.writable)
+        memory.unhashed = set(self.unhashed)
+        self.writable = {}
+        self.owned = set()
+        return memory
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for page_no in range(self.size >> self.page_bits):
+            yield from self.pages.get(page_no, self.zero_page)
+
+    def __eq__(self, other):
+        if not isinstance(other, PagedMemory):
+            other = PagedMemory(other)
+        # Missing pages are zeros, which also makes trailing zeros irrelevant
+        for page_no in self.pages.keys() | other.pages.keys():
+            page = self.pages.get(page_no, self.zero_page)
+            other_page = other.pages.get(page_no, self.zero_page)
+            if type(page) is not type(other_page):
+                # An array page never equals a list one, even with the same values
+                page, other_page = list(page), list(other_page)
+            if page != other_page:
+                return False
+        return True
+
+    def __getitem__(self, addr):
+        if isinstance(addr, slice):
+            return [self[i] for i in range(*addr.indices(self.size))]
+        if addr < 0:
+            raise IndexError(f"Negative address error: {addr}")
+        return self.pages.get(addr >> self.page_bits, self.zero_page)[addr & self.page_mask]
+
+    def __setitem__(self, addr, value):
+        if addr < 0:
+            raise IndexError(f"Negative address error: {addr}")
+
+        page_no = addr >> self.page_bits
+        page = self.writable.get(page_no)
+        if page is None:
+            page_hash = self.page_hashes.pop(page_no, None)
+            if page_hash is not None:
+                self.hash_total -= page_hash
+            self.unhashed.add(page_no)
+            shared = self.pages.get(page_no)
+            if page_no in self.owned:
+                page = shared
+            elif shared is None:
+                page = array("q", self.zero_page)
+                self.size = max(self.size, (page_no + 1) << self.page_bits)
+            else:
+                page = shared[:]
+            self.pages[page_no] = page
+            if page_no in self.watched:
+                self.owned.add(page_no)
+            else:
+                self.owned.discard(page_no)
+                self.writable[page_no] = page
+        try:
+            page[addr & self.page_mask] = value
+        except OverflowError:
+            page = self.pages[page_no] = list(page)
+            if page_no in self.writable:
+                self.writable[page_no] = page
+            page[addr & self.page_mask] = value
+
+    @classmethod
+    def from_image(cls, image):
+        """
+        Memory holding a program image from load_image, copied a page at a time.
+        """
+        if isinstance(image, list):
+            return cls(image)
+        memory = cls()
+        raw = memoryview(image).cast("B")
+        page_bytes = cls.page_size * 8
+        for page_no, start in enumerate(range(0, len(raw), page_bytes)):
+            page = array("q")
+            page.frombytes(raw[start:start + page_bytes])
+            page.extend(cls.zero_page[len(page):])
+            memory.pages[page_no] = page
+            memory.size = (page_no + 1) * cls.page_size
+        memory.writable = dict(memory.pages)
+        return memory
+
+    def watch_pages(self, page_nos):
+        """
+        Make every write to these pages go through __setitem__.
+        """
+        self.watched.update(page_nos)
+        for page_no in page_nos:
+            if self.writable.pop(page_no, None) is not None:
+                self.owned.add(page_no)
+                self.unhashed.add(page_no)
+
+    def content_hash(self):
+        """
+        64 bit hash of the memory's contents, equal for equal memories however they were reached.
+        Only pages written since the last call are hashed again.
+        """
+        for page_no in self.unhashed.union(self.writable):
+            page = self.pages[page_no]
+            if page == self.zero_page:
+                # Zeroed pages hash like missing ones
+                page_hash = 0
+            else:
+                try:
+                    data = array("q", page).tobytes()
+                except OverflowError:
+                    data = ",".join(map(str, page)).encode()
+                digest = hashlib.blake2b(data, digest_size=8, salt=page_no.to_bytes(16, "little")).digest()
+                page_hash = int.from_bytes(digest, "little")
+            self.hash_total += page_hash - self.page_hashes.get(page_no, 0)
+            self.page_hashes[page_no] = page_hash
+        self.unhashed.clear()
+        self.owned.update(self.writable)
+        self.writable.clear()
+
+        return self.hash_total & ((1 << 64) - 1)
+
+
+# Program images shared by every machine, keyed by (path, mtime, size) of the file they were loaded from
+program_images = {}
+
+
+def load_image(program_file, cache_dir=None):
+    """
+    Parse a comma separated Intcode program into an int64 image, once. The image is cached on disk
+    in cache_dir (by default a directory in the system temp dir) keyed by the hash of the file's
+    content and memory-mapped when loaded again, and kept in this process so loading an unchanged
+    file again only costs a stat. Programs with values beyond int64 are returned as a plain list.
+
+    The image is shared and read-only, copy it (PagedMemory.from_image, list()) to run it.
+    """
+    stat = os.stat(program_file)
+    key = (os.path.abspath(program_file), stat.st_mtime_ns, stat.st_size)
+    if key in program_images:
+        return program_images[key]
+
+    with open(program_file, "rb") as int_f:
+        text = int_f.read()
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), "intcode-images")
+    image_file = os.path.join(cache_dir, f"{hashlib.sha256(text).hexdigest()}.q")
+
+    # A cached image is only trusted if it holds exactly one int64 per value of the program
+    if os.path.exists(image_file) and os.path.getsize(image_file) == 8 * (text.count(b",") + 1):
+        with open(image_file, "rb") as image_f:
+            image = memoryview(mmap.mmap(image_f.fileno(), 0, access=mmap.ACCESS_READ)).cast("q")
+    else:
+        values = list(map(int, text.split(b",")))
+        try:
+            image = array("q", values)
+        except OverflowError:
+            image = values
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(f"{image_file}.{os.getpid()}", "wb") as image_f:
+                image.tofile(image_f)
+            os.replace(f"{image_file}.{os.getpid()}", image_file)
+
+    program_images[key] = image
+    return image
+
+
+class RunStats:
+    """
+    Profile of an IntCode machine: instructions executed per op code and per address,
+    relative base and memory high-water marks, and the wall time of each run() call.
+    """
+
+    def __init__(self, op_modes):
+        self.op_modes = op_modes
+        self.op_counts = Counter()
+        self.addr_counts = Counter()
+        self.min_rel_base = 0
+        self.max_rel_base = 0
+        self.max_memory = 0
+        self.run_times = []
+
+    @property
+    def instructions(self):
+        return sum(self.op_counts.values())
+
+    def hot_addresses(self, count=10):
+        return self.addr_counts.most_common(count)
+
+    def to_dict(self):
+        return {
+            "instructions": self.instructions,
+            "op_counts": {self.op_modes[op_mode]: count for op_mode, count in self.op_counts.most_common()},
+            "addr_counts": {str(addr): count for addr, count in sorted(self.addr_counts.items())},
+            "min_rel_base": self.min_rel_base,
+            "max_rel_base": self.max_rel_base,
+            "max_memory": self.max_memory,
+            "run_times": self.run_times,
+        }
+
+    def to_json(self, indent=None):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def dump(self, path):
+        with open(path, "w") as stats_f:
+            stats_f.write(self.to_json(indent=2))
+
+
+# One executed instruction: the raw op code word and its parameters (padded with 0s),
+# and the address/value it wrote, or -1/0 if it didn't write
+TraceRecord = namedtuple("TraceRecord", ["step", "addr", "op_code", "p1", "p2", "p3", "write_addr", "write_value"])
+
+
+class TraceWriter:
+    """
+    Writes an execution trace as fixed width little-endian int64 records through a buffered file,
+    so recording holds at most one buffer in memory however long the run is.
+    Values outside int64 are stored wrapped to 64 bits.
+    """
+
+    record = struct.Struct("<8q")
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.trace_f = open(path, "wb", buffering=buffer_size)
+        self.step = 0
+
+    def write(self, addr, op_code, params, write_addr, write_value):
+        """
+        params must be padded to 3 values.
+        """
+        values = (self.step, addr, op_code, *params, write_addr, write_value)
+        try:
+            self.trace_f.write(self.record.pack(*values))
+        except struct.error:
+            self.trace_f.write(self.record.pack(*(((v + (1 << 63)) % (1 << 64)) - (1 << 63) for v in values)))
+        self.step += 1
+
+    def close(self):
+        self.trace_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TraceReader:
+    """
+    Memory-maps a trace written by TraceWriter. Records are only unpacked when accessed,
+    reader[n] is the record for step n.
+    """
+
+    record = TraceWriter.record
+
+    def __init__(self, path):
+        with open(path, "rb") as trace_f:
+            size = trace_f.seek(0, 2)
+            self.data = mmap.mmap(trace_f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return len(self.data) // self.record.size
+
+    def __getitem__(self, step):
+        if not 0 <= step < len(self):
+            raise IndexError(f"Step {step} is not in the trace ({len(self)} steps)")
+        return TraceRecord(*self.record.unpack_from(self.data, step * self.record.size))
+
+    def __iter__(self):
+        return map(TraceRecord._make, self.record.iter_unpack(self.data))
+
+    def seek(self, step):
+        """
+        Iterate over the records from step onwards.
+        """
+        start = min(step, len(self)) * self.record.size
+        return map(TraceRecord._make, self.record.iter_unpack(memoryview(self.data)[start:]))
+
+    def at_addr(self, addr):
+        """
+        Iterate over the records of the instructions executed at addr.
+        """
+        return (record for record in self if record.addr == addr)
+
+    def diff(self, other, chunk_steps=4096):
+        """
+        First step at which two traces differ as (step, record, other record), a record is None
+        if that trace ended first. Returns None if the traces are identical.
+        """
+        size = self.record.size
+        chunk = chunk_steps * size
+        end = min(len(self), len(other)) * size
+        for start in range(0, end, chunk):
+            stop = min(start + chunk, end)
+            if self.data[start:stop] != other.data[start:stop]:
+                for step in range(start // size, stop // size):
+                    if self[step] != other[step]:
+                        return (step, self[step], other[step])
+        if len(self) != len(other):
+            step = end // size
+            return (
+                step,
+                self[step] if step < len(self) else None,
+                other[step] if step < len(other) else None,
+            )
+        return None
+
+    def close(self):
+        if self.data:
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MemoFrame:
+    """
+    A subroutine call being observed for memoization. A call is a taken jump right after the
+    return address (the jump's fall-through) was written to the stack, it returns when a jump
+    lands back there with the relative base restored.
+
+    reads holds the value of every cell read before being written during the call, writes
+    the final value of every cell written. REL accesses are kept relative to base and POS
+    accesses absolute, which is only sound while they don't overlap, see max_pos/min_rel.
+    """
+
+    def __init__(self, target, base, ret, ret_slot):
+        self.target = target
+        self.base = base
+        self.ret = ret
+        self.ret_slot = ret_slot
+        self.reads = {}
+        self.writes = {}
+        self.max_pos = -1
+        self.min_rel = base
+        self.pure = True
+
+    def merge(self, reads, writes, max_pos, min_rel, pure):
+        """
+        Account for a nested call, given in absolute addresses.
+        """
+        for cell, value in reads.items():
+            if cell not in self.writes and cell not in self.reads:
+                self.reads[cell] = value
+        self.writes.update(writes)
+        self.max_pos = max(self.max_pos, max_pos)
+        self.min_rel = min(self.min_rel, min_rel)
+        self.pure = self.pure and pure
+
+    def entry(self):
+        """
+        Cache entry for this call as (reads, writes, max_pos, min_rel offset), with
+        (relative, cell, value) items, or None if its effects can't be replayed elsewhere.
+        """
+        if not self.pure or self.max_pos >= self.base or self.min_rel < self.base:
+            return None
+        base = self.base
+        reads = tuple((cell >= base, cell - base if cell >= base else cell, value) for cell, value in self.reads.items())
+        writes = tuple((cell >= base, cell - base if cell >= base else cell, value) for cell, value in self.writes.items())
+        return (reads, writes, self.max_pos, self.min_rel - base)
+
+
 class IntCode:
-    def __init__(self, program):
-        self.program = program
-        self.addr = 0
-        self.rel_base = 0
-        self.output = []
-        self.input = []
+    # Number of parameters taken by each op code
+    op_params = {1: 3, 2: 3, 3: 1, 4: 1, 5: 2, 6: 2, 7: 3, 8: 3, 9: 1, 99: 0}
+    # Parameter each op code writes its result to
+    op_writes = {1: 3, 2: 3, 3: 1, 7: 3, 8: 3}
+
+    # Handler bodies, specialised per parameter mode when an instruction is decoded.
+    # R<n> reads parameter n, W<n> is the address parameter n writes to and
+    # "STORE W<n>" writes v there.
+    op_templates = {
+        1: ["v = R1 + R2", "STORE W3", "return nxt"],
+        2: ["v = R1 * R2", "STORE W3", "return nxt"],
+        3: [
+            "if not vm.input:",
+            "    if vm.pause_on_input:",
+            "        vm.status = 'NEEDS_INPUT'",
+            "        return addr",
+            "    vm.input.append(int(input('Input: ')))",
+            "v = vm.input.popleft()",
+            "STORE W1",
+            "return nxt",
+        ],
+        4: ["vm.output.append(R1)", "return nxt"],
+        5: ["return R2 if R1 != 0 else nxt"],
+        6: ["return R2 if R1 == 0 else nxt"],
+        7: ["v = 1 if R1 < R2 else 0", "STORE W3", "return nxt"],
+        8: ["v = 1 if R1 == R2 else 0", "STORE W3", "return nxt"],
+        9: ["vm.rel_base += R1", "return nxt"],
+        99: ["print('Program reached its end!')", "return addr"],
+    }
+
+    # Straight-line code emitted for each op code by the compiled backend.
+    # Jumps end a block, writes bail out to the caller if they hit compiled code.
+    block_templates = {
+        1: ["v = R1 + R2", "STORE W3"],
+        2: ["v = R1 * R2", "STORE W3"],
+        5: ["if R1 != 0:", "    return R2"],
+        6: ["if R1 == 0:", "    return R2"],
+        7: ["v = 1 if R1 < R2 else 0", "STORE W3"],
+        8: ["v = 1 if R1 == R2 else 0", "STORE W3"],
+        9: ["rb += R1", "vm.rel_base = rb"],
+    }
+    max_block_size = 64
+    # Most compiled blocks and superinstructions a machine keeps, the oldest are dropped first
+    max_compiled_blocks = 1024
+    # Times the interpreter runs an instruction directly (see _step) before decoding it into a handler
+    decode_after = 2
+    # Checkpoint file layout, see save()
+    checkpoint_magic = b"ICK1"
+    checkpoint_header = struct.Struct("<4sqqBq")
+    checkpoint_page = struct.Struct("<qB")
+    checkpoint_length = struct.Struct("<q")
+    statuses = ("RUNNING", "PAUSED", "NEEDS_INPUT", "HALTED", "WATCHPOINT")
+    # Most nested calls observed at once by the memoizing loop
+    max_memo_depth = 10000
+
+    # (op_mode, param modes) of every op code word fetched so far, shared by every machine
+    op_code_modes = {}
+    # Handler factories shared by every machine, keyed by (op_mode, param modes)
+    handler_factories = {}
+
+    def __init__(
+        self, program, addr=0, rel_base=0, backend="interpreter", superinstructions=True, profile=False, memoize=False
+    ):
+        if backend not in ("interpreter", "compiled"):
+            raise ValueError(f"Invalid backend: {backend}")
+
+        if isinstance(program, PagedMemory):
+            self.program = program.copy()
+        else:
+            self.program = PagedMemory(program)
+        self.addr = addr
+        self.rel_base = rel_base
+        self.output = deque()
+        self.input = deque()
+        # RUNNING, PAUSED (after an output), NEEDS_INPUT, WATCHPOINT or HALTED
+        self.status = "RUNNING"
+        self.pause_on_input = False
         self.op_modes = {
             1: "SUM",
             2: "MUL",
@@ -90,14 +615,166 @@ class IntCode:
             1: "IMM",
             2: "REL",
         }
+        # addr -> (op_mode, handler) for every instruction or superinstruction decoded so far
+        self.decoded = {}
+        self.decoded_ends = {}
+        # addr -> times the instruction there has run without being decoded
+        self.cold_hits = {}
+        # Fuse common op code sequences (see _fusion) into a single decoded entry
+        self.superinstructions = superinstructions
+        # addr -> tuple of start addrs of the decoded instructions and compiled blocks covering it
+        self.decoded_span = {}
+        # Start addrs of decoded code later overwritten, which is never fused or compiled again
+        self.modified_code = set()
+        self.backend = backend
+        # addr -> compiled block starting there, or False to use the interpreter
+        self.blocks = {}
+        self.block_ends = {}
+        # Compiled functions keyed by generated source, which embeds operand values, so bounded per machine
+        self.compiled_blocks = {}
+        # RunStats and TraceWriter fed by a separate instrumented loop, None when not in use
+        self.stats = RunStats(self.op_modes) if profile else None
+        self.tracer = None
+        # Subroutine memoization: target addr -> list of MemoFrame entries, calls being observed
+        # and the fetched instructions of the memoizing loop
+        self.memoize = memoize
+        self.memo = {}
+        self.memo_frames = []
+        self.memo_fetched = {}
+        # (start, end, callback, pause) per watched address range, see watch()
+        self.watchpoints = []
+        self.last_watch = None
 
     @classmethod
-    def from_ext_file(cls, program_file):
-        intcode = []
-        with open(program_file, "r") as int_f:
-            intcode = int_f.read().split(",")
+    def from_ext_file(cls, program_file, backend="interpreter", cache_dir=None, **options):
+        intcode_prog = cls([], backend=backend, **options)
+        intcode_prog.program = PagedMemory.from_image(load_image(program_file, cache_dir))
+        return intcode_prog
+
+    def state_hash(self):
+        """
+        Fingerprint of the machine's state (memory, ip and relative base, not pending I/O),
+        equal for machines in the same state however they got there.
+        """
+        return hash((self.program.content_hash(), self.addr, self.rel_base))
+
+    def copy_state(self):
+        # This caused a ton of problems, because list passed to a class is a reference mutable.
+        return (self.program.copy(), self.addr, self.rel_base)
+
+    @classmethod
+    def from_existing_state(cls, state, backend="interpreter"):
+        return cls(*state, backend=backend)
+
+    def fork(self):
+        """
+        Clone this machine for searching. Memory pages are shared copy-on-write, so a fork
+        only costs the pages either machine writes to afterwards. Pending input is copied,
+        output is not.
+        """
+        child = type(self)(
+            [],
+            self.addr,
+            self.rel_base,
+            backend=self.backend,
+            superinstructions=self.superinstructions,
+            profile=self.stats is not None,
+            memoize=self.memoize,
+        )
+        child.program = self.program.fork()
+        child.input = deque(self.input)
+        child.status = self.status
+        # Decoded code is only invalidated by writes, so both machines can start from it
+        child.decoded = dict(self.decoded)
+        child.decoded_ends = dict(self.decoded_ends)
+        child.decoded_span = dict(self.decoded_span)
+        child.modified_code = set(self.modified_code)
+        child.cold_hits = dict(self.cold_hits)
+        child.blocks = dict(self.blocks)
+        child.compiled_blocks = self.compiled_blocks
+        child.block_ends = dict(self.block_ends)
+        # Calls in progress are just not cached by the child
+        child.memo = self.memo
+        child.memo_fetched = dict(self.memo_fetched)
+        return child
+
+    def snapshot(self):
+        """
+        Compact binary state of this machine: a header with ip, relative base, status and page count,
+        pending input and output as comma separated text, then every non-zero memory page as its
+        page number and either raw int64 values or, for pages beyond int64, comma separated text.
+        """
+        pages = [
+            (page_no, page) for page_no, page in sorted(self.program.pages.items()) if page != PagedMemory.zero_page
+        ]
+        chunks = [self.checkpoint_header.pack(
+            self.checkpoint_magic, self.addr, self.rel_base, self.statuses.index(self.status), len(pages)
+        )]
+        for channel in (self.input, self.output):
+            text = ",".join(map(str, channel)).encode()
+            chunks.append(self.checkpoint_length.pack(len(text)) + text)
+        for page_no, page in pages:
+            if isinstance(page, array):
+                chunks.append(self.checkpoint_page.pack(page_no, 0) + page.tobytes())
+            else:
+                text = ",".join(map(str, page)).encode()
+                chunks.append(self.checkpoint_page.pack(page_no, 1) + self.checkpoint_length.pack(len(text)) + text)
+        return b"".join(chunks)
+
+    @classmethod
+    def from_snapshot(cls, data, backend="interpreter", **options):
+        """
+        Machine restored from snapshot() bytes, or any buffer holding them.
+        """
+        magic, addr, rel_base, status, page_count = cls.checkpoint_header.unpack_from(data)
+        if magic != cls.checkpoint_magic:
+            raise ValueError("Not an IntCode snapshot")
+        intcode_prog = cls([], addr, rel_base, backend=backend, **options)
+        intcode_prog.status = cls.statuses[status]
+        offset = cls.checkpoint_header.size
+
+        def read_text():
+            nonlocal offset
+            (length,) = cls.checkpoint_length.unpack_from(data, offset)
+            offset += cls.checkpoint_length.size
+            text = data[offset:offset + length]
+            offset += length
+            return [int(value) for value in text.split(b",")] if text else []
+
+        intcode_prog.input.extend(read_text())
+        intcode_prog.output.extend(read_text())
 
-        return cls(list(map(int, intcode)))
+        memory = intcode_prog.program
+        page_bytes = PagedMemory.page_size * 8
+        for _ in range(page_count):
+            page_no, kind = cls.checkpoint_page.unpack_from(data, offset)
+            offset += cls.checkpoint_page.size
+            if kind == 0:
+                page = array("q")
+                page.frombytes(data[offset:offset + page_bytes])
+                offset += page_bytes
+            else:
+                page = read_text()
+            memory.pages[page_no] = page
+            memory.size = max(memory.size, (page_no + 1) * PagedMemory.page_size)
+        memory.writable = dict(memory.pages)
+
+        return intcode_prog
+
+    def save(self, path):
+        """
+        Checkpoint this machine to path as a snapshot().
+        """
+        with open(path, "wb") as checkpoint_f:
+            checkpoint_f.write(self.snapshot())
+
+    @classmethod
+    def load(cls, path, backend="interpreter", **options):
+        """
+        Restore a machine checkpointed with save(), reading the file through a memory map.
+        """
+        with open(path, "rb") as checkpoint_f, mmap.mmap(checkpoint_f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return cls.from_snapshot(data, backend=backend, **options)
 
     def _compute_op_code(self, op_code):
         op_mode = op_code % 100
@@ -105,7 +782,7 @@ class IntCode:
 
         param_mode_map = {}
 
-        if op_mode not in self.op_modes:
+        if op_code < 0 or op_mode not in self.op_modes:
             raise ValueError(f"Invalid op code: {op_mode} - {op_code}")
 
         i = 0
@@ -116,140 +793,935 @@ class IntCode:
 
         return (op_mode, param_mode_map)
 
-    def _get_value_addr(self, offset, mode_map, ret="value"):
-        mode = mode_map.get(offset, 0)
-        mode_name = self.param_modes[mode]
-        addr = self.addr + offset
-        value_addr = None
-
-        if mode_name == "POS":
-            value_addr = self.program[addr]
-        elif mode_name == "IMM":
-            value_addr = addr
-        elif mode_name == "REL":
-            value_addr = self.rel_base + self.program[addr]
+    @staticmethod
+    def _read_expr(mode, param, page=None, offset=None):
+        bits, mask = PagedMemory.page_bits, PagedMemory.page_mask
+        if mode == 0:
+            return f"pages.get({page}, zero)[{offset}]"
+        elif mode == 1:
+            return param
+        elif mode == 2:
+            return f"pages.get((rb + {param}) >> {bits}, zero)[(rb + {param}) & {mask}]"
+        raise KeyError(f"Invalid parameter mode: {mode}")
+
+    @staticmethod
+    def _write_expr(mode, param):
+        # Immediate mode writes are resolved to the parameter's own address when decoding
+        if mode in (0, 1):
+            return param
+        elif mode == 2:
+            return f"rb + {param}"
+        raise KeyError(f"Invalid parameter mode: {mode}")
+
+    @staticmethod
+    def _store_lines(line, block):
+        """
+        Expand a STORE pseudo line into an inline write of v. Writes to pages this machine
+        doesn't own yet, to decoded code or that overflow int64 go through _assign.
+        """
+        indent = line[:len(line) - len(line.lstrip())]
+        target = line.split("STORE ", 1)[1]
+        slow = ["if vm._assign(t, v):", "    return nxt"] if block else ["vm._assign(t, v)"]
+        lines = [
+            f"t = {target}",
+            f"page = writable.get(t >> {PagedMemory.page_bits})",
+            "if page is None or t in span:",
+            *[f"    {slow_line}" for slow_line in slow],
+            "else:",
+            "    try:",
+            f"        page[t & {PagedMemory.page_mask}] = v",
+            "    except OverflowError:",
+            *[f"        {slow_line}" for slow_line in slow],
+        ]
+        return [f"{indent}{store_line}" for store_line in lines]
+
+    @classmethod
+    def _handler_factory(cls, op_mode, modes):
+        key = (op_mode, modes)
+        if key not in cls.handler_factories:
+            prelude = []
+            body = []
+            for i, mode in enumerate(modes, start=1):
+                if mode == 0:
+                    prelude.append(f"    p{i}_page, p{i}_off = p{i} >> {PagedMemory.page_bits}, p{i} & {PagedMemory.page_mask}")
+            for line in cls.op_templates[op_mode]:
+                for i, mode in enumerate(modes, start=1):
+                    line = line.replace(f"R{i}", cls._read_expr(mode, f"p{i}", f"p{i}_page", f"p{i}_off"))
+                    line = line.replace(f"W{i}", cls._write_expr(mode, f"p{i}"))
+                if "STORE " in line:
+                    body.append("        span = vm.decoded_span")
+                    body.append("        writable = vm.program.writable")
+                    body.extend(f"        {store_line}" for store_line in cls._store_lines(line, block=False))
+                else:
+                    body.append(f"        {line}")
+
+            src = "\n".join([
+                "def factory(addr, nxt, p1=0, p2=0, p3=0):",
+                *prelude,
+                "    def handler(vm):",
+                "        pages = vm.program.pages",
+                "        rb = vm.rel_base",
+                *body,
+                "    return handler",
+            ])
+            namespace = {"zero": PagedMemory.zero_page}
+            exec(src, namespace)
+            cls.handler_factories[key] = namespace["factory"]
+
+        return cls.handler_factories[key]
+
+    def _fetch(self, addr):
+        op_code = self.program[addr]
+        if op_code not in self.op_code_modes:
+            op_mode, param_mode_map = self._compute_op_code(op_code)
+            modes = tuple(param_mode_map.get(i, 0) for i in range(1, self.op_params[op_mode] + 1))
+            for mode in modes:
+                if mode not in self.param_modes:
+                    # Rejected here so running an instruction directly fails like decoding it
+                    raise KeyError(f"Invalid parameter mode: {mode}")
+            self.op_code_modes[op_code] = (op_mode, modes)
+        op_mode, modes = self.op_code_modes[op_code]
+        num_params = len(modes)
+
+        params = []
+        for i, mode in enumerate(modes, start=1):
+            if mode == 1 and self.op_writes.get(op_mode) == i:
+                params.append(addr + i)
+            else:
+                params.append(self.program[addr + i])
+
+        return (op_mode, modes, params, addr + num_params + 1)
+
+    def _add_span(self, start, end):
+        for span_addr in range(start, end):
+            self.decoded_span[span_addr] = self.decoded_span.get(span_addr, ()) + (start,)
+
+    def _fusion(self, addr):
+        """
+        Name and length of the superinstruction starting at addr, or (None, 1). Recognised patterns:
+        - CMP_JUMP: LESS/EQUALS then a JUMP_T/JUMP_F testing its result
+        - REL_<op>: ADJ_REL pushing/popping a frame then the op using it, which may itself be a CMP_JUMP
+        """
+        ops = []
+        for _ in range(3):
+            if addr in self.modified_code:
+                # Self-modifying code would be fused again after every write
+                break
+            try:
+                op = self._fetch(addr)
+            except (ValueError, KeyError):
+                break
+            ops.append(op)
+            if ops[0][0] not in (7, 8, 9):
+                # Only compares and ADJ_REL start a superinstruction
+                return (None, 1)
+            if op[0] not in (7, 8) and not (op[0] == 9 and len(ops) == 1):
+                # Only a compare or a leading ADJ_REL can be continued, never look past a jump or HALT
+                break
+            addr = op[3]
+
+        def cmp_jump(i):
+            if len(ops) < i + 2 or ops[i][0] not in (7, 8) or ops[i + 1][0] not in (5, 6):
+                return False
+            _, cmp_modes, cmp_params, _ = ops[i]
+            _, jump_modes, jump_params, _ = ops[i + 1]
+            return cmp_modes[2] == jump_modes[0] != 1 and cmp_params[2] == jump_params[0]
+
+        if ops and ops[0][0] == 9 and len(ops) > 1 and ops[1][0] in (1, 2, 5, 6, 7, 8):
+            if cmp_jump(1):
+                return ("REL_CMP_JUMP", 3)
+            return (f"REL_{self.op_modes[ops[1][0]]}", 2)
+        if cmp_jump(0):
+            return ("CMP_JUMP", 2)
+        return (None, 1)
+
+    def _decode(self, addr, fuse=True):
+        if addr >= len(self.program):
+            raise OverflowError(f"Current address ({addr}) exceeds program size ({len(self.program)})")
+
+        name, count = self._fusion(addr) if fuse and self.superinstructions else (None, 1)
+        if name:
+            handler, op_mode, nxt = self._block(addr, count)
         else:
-            raise KeyError(f"Invalid parameter mode: {mode_name}")
+            op_mode, modes, params, nxt = self._fetch(addr)
+            handler = self._handler_factory(op_mode, modes)(addr, nxt, *params)
+
+        self.decoded[addr] = (op_mode, handler)
+        self.decoded_ends[addr] = nxt
+        self._add_span(addr, nxt)
+
+        return (op_mode, handler)
 
-        if ret == "value":
-            return 0 if value_addr >= len(self.program) else self.program[value_addr]
-        elif ret == "addr":
-            return value_addr
+    def _step(self, addr):
+        """
+        Execute the instruction at addr without decoding it, which is cheaper for code that only
+        runs a few times. Returns (op_mode, next addr) like a decoded handler would.
+        """
+        program = self.program
+        if addr >= program.size:
+            raise OverflowError(f"Current address ({addr}) exceeds program size ({len(program)})")
+        # Memory is read straight from its pages, PagedMemory.__getitem__ costs more than the instruction
+        page_of = program.pages.get
+        zero, bits, mask = PagedMemory.zero_page, PagedMemory.page_bits, PagedMemory.page_mask
+        op_code = page_of(addr >> bits, zero)[addr & mask]
+        info = self.op_code_modes.get(op_code)
+        if info is None:
+            self._fetch(addr)
+            info = self.op_code_modes[op_code]
+        op_mode, modes = info
+
+        # Address of every parameter's cell, an IMM parameter being its own cell. Cells are only
+        # read when the instruction uses them, negative ones reading as 0 like in decoded handlers
+        rb = self.rel_base
+        cells = []
+        for i, mode in enumerate(modes, start=1):
+            cell = addr + i
+            if mode != 1:
+                cell = page_of(cell >> bits, zero)[cell & mask] + (rb if mode == 2 else 0)
+            cells.append(cell)
+        nxt = addr + len(modes) + 1
+
+        if op_mode in (1, 2, 7, 8):
+            a = page_of(cells[0] >> bits, zero)[cells[0] & mask]
+            b = page_of(cells[1] >> bits, zero)[cells[1] & mask]
+            if op_mode == 1:
+                value = a + b
+            elif op_mode == 2:
+                value = a * b
+            elif op_mode == 7:
+                value = 1 if a < b else 0
+            else:
+                value = 1 if a == b else 0
+            self._assign(cells[2], value)
+        elif op_mode == 3:
+            if not self.input:
+                if self.pause_on_input:
+                    self.status = "NEEDS_INPUT"
+                    return (op_mode, addr)
+                self.input.append(int(input("Input: ")))
+            self._assign(cells[0], self.input.popleft())
+        elif op_mode == 4:
+            self.output.append(page_of(cells[0] >> bits, zero)[cells[0] & mask])
+        elif op_mode in (5, 6):
+            if (page_of(cells[0] >> bits, zero)[cells[0] & mask] != 0) == (op_mode == 5):
+                nxt = page_of(cells[1] >> bits, zero)[cells[1] & mask]
+        elif op_mode == 9:
+            self.rel_base += page_of(cells[0] >> bits, zero)[cells[0] & mask]
         else:
-            raise AttributeError(f"Invalid ret type: {ret}")
+            print("Program reached its end!")
+            nxt = addr
+        return (op_mode, nxt)
+
+    def _compile_block(self, addr):
+        """
+        Compile the straight-line run of instructions starting at addr into a single function.
+        Blocks stop at I/O and END, which are left to the interpreter, or after a jump.
+        """
+        block, _, end = self._block(addr, self.max_block_size)
+        if block is None:
+            self.blocks[addr] = False
+            return False
+
+        self.blocks[addr] = block
+        self.block_ends[addr] = end
+        self._add_span(addr, end)
+
+        return block
+
+    def _block(self, addr, max_count):
+        """
+        Generate a function running up to max_count straight-line instructions from addr.
+        Returns (function, last op_mode, end addr), function is None if addr can't start a block.
+        """
+        program = self.program
+        lines = []
+        count = 0
+        op_mode = None
+
+        while count < max_count and 0 <= addr < len(program):
+            if program[addr] % 100 not in self.block_templates or addr in self.modified_code:
+                break
+
+            try:
+                op_mode, modes, params, nxt = self._fetch(addr)
+            except (ValueError, KeyError):
+                # Invalid words end the block, the interpreter reports them if they are ever run
+                break
+            for line in self.block_templates[op_mode]:
+                for i, (mode, param) in enumerate(zip(modes, params), start=1):
+                    page, offset = param >> PagedMemory.page_bits, param & PagedMemory.page_mask
+                    if mode == 0 and page in program.pages:
+                        # Pages are never dropped, so this read can skip the lookup default
+                        read = f"pages[{page}][{offset}]"
+                    else:
+                        read = self._read_expr(mode, str(param), page, offset)
+                    line = line.replace(f"R{i}", read)
+                    line = line.replace(f"W{i}", self._write_expr(mode, str(param)))
+                op_lines = self._store_lines(line, block=True) if "STORE " in line else [line]
+                lines.extend(f"    {op_line.replace('nxt', str(nxt))}" for op_line in op_lines)
+
+            count += 1
+            addr = nxt
+            if op_mode in (5, 6):
+                break
+
+        if not count:
+            return (None, None, addr)
+
+        src = "\n".join([
+            "def block(vm):",
+            "    pages = vm.program.pages",
+            "    span = vm.decoded_span",
+            "    writable = vm.program.writable",
+            "    rb = vm.rel_base",
+            *lines,
+            f"    return {addr}",
+        ])
+        block = self.compiled_blocks.get(src)
+        if block is None:
+            namespace = {"zero": PagedMemory.zero_page}
+            exec(src, namespace)
+            block = namespace["block"]
+            if len(self.compiled_blocks) >= self.max_compiled_blocks:
+                del self.compiled_blocks[next(iter(self.compiled_blocks))]
+            self.compiled_blocks[src] = block
+
+        return (block, op_mode, addr)
+
+    def _invalidate(self, tgt_addr):
+        for start in self.decoded_span.pop(tgt_addr):
+            self.modified_code.add(start)
+            # The new code has to prove hot again before it is decoded
+            self.cold_hits.pop(start, None)
+            end = start
+            if self.decoded.pop(start, None) is not None:
+                end = self.decoded_ends.pop(start)
+            if start in self.block_ends:
+                # Self-modified blocks fall back to the interpreter from now on
+                end = max(end, self.block_ends.pop(start))
+                self.blocks[start] = False
+            if start in self.memo_fetched:
+                end = max(end, self.memo_fetched.pop(start)[3])
+                # Cached calls may have run the old code
+                self.memo = {}
+
+            for span_addr in range(start, end):
+                starts = tuple(s for s in self.decoded_span.get(span_addr, ()) if s != start)
+                if starts:
+                    self.decoded_span[span_addr] = starts
+                else:
+                    self.decoded_span.pop(span_addr, None)
+
+    def _unfuse(self):
+        """
+        Drop decoded superinstructions so every instruction is decoded on its own again.
+        """
+        for start, end in list(self.decoded_ends.items()):
+            if end == start + self.op_params[self.program[start] % 100] + 1:
+                continue
+            del self.decoded[start]
+            del self.decoded_ends[start]
+            for span_addr in range(start, end):
+                starts = tuple(s for s in self.decoded_span[span_addr] if s != start)
+                if starts:
+                    self.decoded_span[span_addr] = starts
+                else:
+                    del self.decoded_span[span_addr]
 
     def _assign(self, tgt_addr, value):
-        if tgt_addr < 0:
-            raise IndexError(f"Negative address error: {tgt_addr}")
-        if tgt_addr >= len(self.program):
-            diff = tgt_addr - len(self.program) + 1
-            self.program.extend([0] * diff)
+        """
+        Returns True if the write landed in code that had already been decoded or compiled,
+        or hit a pausing watchpoint.
+        """
         self.program[tgt_addr] = value
+        if self.watchpoints and self._check_watchpoints(tgt_addr, value):
+            if tgt_addr in self.decoded_span:
+                self._invalidate(tgt_addr)
+            return True
+        if tgt_addr in self.decoded_span:
+            self._invalidate(tgt_addr)
+            return True
+        return False
 
-    def _execute(self, op_mode, param_mode_map):
-        op_name = self.op_modes[op_mode]
-        ref = self.addr
-
-        if op_name == "SUM":
-            p1 = self._get_value_addr(1, param_mode_map)
-            p2 = self._get_value_addr(2, param_mode_map)
-            p3 = self._get_value_addr(3, param_mode_map, ret="addr")
-            self._assign(p3, p1 + p2)
-            self.addr += 4
-
-        elif op_name == "MUL":
-            p1 = self._get_value_addr(1, param_mode_map)
-            p2 = self._get_value_addr(2, param_mode_map)
-            p3 = self._get_value_addr(3, param_mode_map, ret="addr")
-            self._assign(p3, p1 * p2)
-            self.addr += 4
-
-        elif op_name == "IN":
-            p1 = self._get_value_addr(1, param_mode_map, ret="addr")
-            if not self.input:
-                self.input.append(int(input("Input: ")))
-            self._assign(p1, self.input.pop(0))
-            self.addr += 2
-
-        elif op_name == "OUT":
-            p1 = self._get_value_addr(1, param_mode_map)
-            self.output.append(p1)
-            self.addr += 2
-
-        elif op_name == "JUMP_T":
-            p1 = self._get_value_addr(1, param_mode_map)
-            if p1 != 0:
-                self.addr = self._get_value_addr(2, param_mode_map)
-            else:
-                self.addr += 3
+    def watch(self, start, end=None, callback=None, pause=False):
+        """
+        Watch writes to addresses start..end - 1 (just start by default). Each write calls
+        callback(vm, addr, value) if given, and with pause, run() returns with status WATCHPOINT
+        right after the writing instruction; last_watch holds the (addr, value) written.
+        Writes to watched pages take the interpreter's slow path, the rest of memory is unaffected.
+        """
+        end = start + 1 if end is None else end
+        self.watchpoints.append((start, end, callback, pause))
+        self.program.watch_pages(range(start >> PagedMemory.page_bits, ((end - 1) >> PagedMemory.page_bits) + 1))
+
+    def _check_watchpoints(self, tgt_addr, value):
+        """
+        Fire the watchpoints covering tgt_addr, returns True if one of them pauses the machine.
+        """
+        pause = False
+        for start, end, callback, pause_here in self.watchpoints:
+            if start <= tgt_addr < end:
+                self.last_watch = (tgt_addr, value)
+                if callback is not None:
+                    callback(self, tgt_addr, value)
+                if pause_here:
+                    self.status = "WATCHPOINT"
+                    pause = True
+        return pause
 
-        elif op_name == "JUMP_F":
-            p1 = self._get_value_addr(1, param_mode_map)
-            if p1 == 0:
-                self.addr = self._get_value_addr(2, param_mode_map)
+    def peek(self, start, end=None):
+        """
+        Read addresses start..end - 1 (just start by default) without running or stopping the machine,
+        e.g. from a watchpoint callback.
+        """
+        if end is None:
+            return self.program[start]
+        return self.program[start:end]
+
+    def basic_blocks(self, entries=(0,)):
+        """
+        Static control flow graph reached from entries through fall-through and immediate jump targets.
+        Returns {start: (end, successors)}. Jumps to addresses read from memory, like returns from a
+        call, have no static successor, so code only reached through them is not found.
+        """
+        instructions = {}
+        leaders = set(entries)
+        pending = list(entries)
+
+        while pending:
+            addr = pending.pop()
+            while addr not in instructions and 0 <= addr < len(self.program):
+                try:
+                    op_mode, modes, params, nxt = self._fetch(addr)
+                except (ValueError, KeyError):
+                    break
+                instructions[addr] = (op_mode, modes, params, nxt)
+                if op_mode == 99:
+                    break
+                if op_mode in (5, 6):
+                    if modes[1] == 1:
+                        leaders.add(params[1])
+                        pending.append(params[1])
+                    if modes[0] == 1 and (params[0] != 0) == (op_mode == 5):
+                        # Always taken
+                        break
+                    leaders.add(nxt)
+                addr = nxt
+
+        blocks = {}
+        for start in sorted(leaders & instructions.keys()):
+            addr = start
+            successors = []
+            while True:
+                op_mode, modes, params, nxt = instructions[addr]
+                if op_mode in (5, 6):
+                    if modes[1] == 1:
+                        successors.append(params[1])
+                    if not (modes[0] == 1 and (params[0] != 0) == (op_mode == 5)):
+                        successors.append(nxt)
+                    break
+                if op_mode == 99 or nxt not in instructions:
+                    break
+                if nxt in leaders:
+                    successors.append(nxt)
+                    break
+                addr = nxt
+            blocks[start] = (nxt, successors)
+
+        return blocks
+
+    def superinstruction_sites(self, entries=(0,)):
+        """
+        {addr: pattern name} for every superinstruction the interpreter will fuse in the code reached from entries.
+        """
+        sites = {}
+        for start, (end, _) in self.basic_blocks(entries).items():
+            addr = start
+            while addr < end:
+                name, count = self._fusion(addr)
+                if name:
+                    sites[addr] = name
+                addr = self._fetch(addr)[3]
+        return sites
+
+    def disassemble(self, entries=(0,), hits=None):
+        """
+        Listing of the code reached from entries, one basic block at a time. Each line holds the raw
+        words, the mnemonic with POS operands as [addr], IMM as #value and REL as [rb+offset], the
+        superinstruction starting there if any, and its hit count when given a {addr: count} dict.
+        """
+        sites = self.superinstruction_sites(entries)
+        lines = []
+        for start, (end, successors) in self.basic_blocks(entries).items():
+            lines.append(f"block {start}-{end - 1} -> {', '.join(map(str, successors)) or '-'}")
+            addr = start
+            while addr < end:
+                op_mode, modes, _, nxt = self._fetch(addr)
+                operands = []
+                for mode, param in zip(modes, self.program[addr + 1:nxt]):
+                    if mode == 0:
+                        operands.append(f"[{param}]")
+                    elif mode == 1:
+                        operands.append(f"#{param}")
+                    else:
+                        operands.append(f"[rb{param:+}]")
+                words = " ".join(map(str, self.program[addr:nxt]))
+                line = f"{addr:>6}: {words:<28} {self.op_modes[op_mode]:<8} {', '.join(operands):<24}"
+                line += f" {sites.get(addr, ''):<12}"
+                if hits is not None:
+                    line += f" {hits.get(addr, 0):>10}"
+                lines.append(line.rstrip())
+                addr = nxt
+        return "\n".join(lines)
+
+    def _run_instrumented(self, addr, stop_ops, halt_ops):
+        """
+        The interpreter loop of run(), counting every instruction into self.stats and recording
+        it with self.tracer. Each instruction is dispatched on its own, without superinstructions
+        or compiled blocks, so counts and traces are exact.
+        """
+        stats = self.stats
+        tracer = self.tracer
+        program = self.program
+        decoded = self.decoded
+        # addr -> (decoded entry, op code word, padded params, write param offset or None, relative write)
+        trace_info = {}
+        self._unfuse()
+        start = time.perf_counter()
+
+        while True:
+            entry = decoded.get(addr)
+            if entry is None:
+                entry = self._decode(addr, fuse=False)
+            op_mode, handler = entry
+            if tracer is not None:
+                info = trace_info.get(addr)
+                if info is None or info[0] is not entry:
+                    # Decode again if the instruction was modified since
+                    _, modes, params, _ = self._fetch(addr)
+                    write_param = self.op_writes.get(op_mode)
+                    raw_params = tuple(program[addr + 1:addr + len(params) + 1]) + (0,) * (3 - len(params))
+                    if write_param is None:
+                        info = (entry, program[addr], raw_params, None, False)
+                    else:
+                        info = (entry, program[addr], raw_params, params[write_param - 1], modes[write_param - 1] == 2)
+                    trace_info[addr] = info
+                _, op_code, params, write_addr, relative = info
+                if relative:
+                    write_addr += self.rel_base
+
+            nxt = handler(self)
+            if op_mode == 3 and self.status == "NEEDS_INPUT":
+                break
+
+            if stats is not None:
+                stats.op_counts[op_mode] += 1
+                stats.addr_counts[addr] += 1
+                if op_mode == 9:
+                    stats.min_rel_base = min(stats.min_rel_base, self.rel_base)
+                    stats.max_rel_base = max(stats.max_rel_base, self.rel_base)
+            if tracer is not None:
+                if write_addr is None:
+                    tracer.write(addr, op_code, params, -1, 0)
+                else:
+                    tracer.write(addr, op_code, params, write_addr, program[write_addr])
+            addr = nxt
+
+            if op_mode in stop_ops and (op_mode in halt_ops or self.status != "RUNNING"):
+                break
+
+        if stats is not None:
+            stats.max_memory = max(stats.max_memory, len(self.program))
+            stats.run_times.append(time.perf_counter() - start)
+        return (addr, op_mode)
+
+    def _memo_lookup(self, target, base):
+        """
+        Cached entry of a call to target with relative base base whose reads match memory, or None.
+        Entries whose absolute cells reach the new base are skipped, as their REL cells would overlap them.
+        """
+        program = self.program
+        for entry in self.memo.get(target, ()):
+            reads, writes, max_pos, _ = entry
+            if max_pos >= base:
+                continue
+            if all(program[base + cell if relative else cell] == value for relative, cell, value in reads) and not any(
+                (base + cell if relative else cell) in self.decoded_span for relative, cell, _ in writes
+            ):
+                return entry
+        return None
+
+    def _run_memoized(self, addr, stop_ops, halt_ops):
+        """
+        The interpreter loop of run() with subroutine memoization. Every instruction's memory
+        accesses are recorded into the innermost call being observed; when a call returns
+        having only touched memory (no I/O, no self-modification) its reads and writes are
+        cached, and later calls to the same address reading the same values just replay
+        the writes.
+        """
+        program = self.program
+        frames = self.memo_frames
+        fetched = self.memo_fetched
+        last_write = None
+
+        while True:
+            info = fetched.get(addr)
+            if info is None:
+                if addr >= len(program):
+                    raise OverflowError(f"Current address ({addr}) exceeds program size ({len(program)})")
+                info = self._fetch(addr)
+                fetched[addr] = info
+                self._add_span(addr, info[3])
+            op_mode, modes, params, nxt = info
+            frame = frames[-1] if frames else None
+            rb = self.rel_base
+
+            cells = []
+            for mode, param in zip(modes, params):
+                if mode == 1:
+                    cells.append(None)
+                    continue
+                cell = param if mode == 0 else rb + param
+                cells.append(cell)
+                if frame is not None:
+                    if mode == 0:
+                        frame.max_pos = max(frame.max_pos, cell)
+                    else:
+                        frame.min_rel = min(frame.min_rel, cell)
+
+            def read(i):
+                cell = cells[i]
+                if cell is None:
+                    return params[i]
+                value = program[cell]
+                if frame is not None and cell not in frame.writes and cell not in frame.reads:
+                    frame.reads[cell] = value
+                return value
+
+            write = None
+            if op_mode in (1, 2, 7, 8):
+                a, b = read(0), read(1)
+                if op_mode == 1:
+                    write = a + b
+                elif op_mode == 2:
+                    write = a * b
+                elif op_mode == 7:
+                    write = 1 if a < b else 0
+                else:
+                    write = 1 if a == b else 0
+                cell = cells[2] if cells[2] is not None else addr + 3
+            elif op_mode == 3:
+                if not self.input:
+                    if self.pause_on_input:
+                        self.status = "NEEDS_INPUT"
+                        break
+                    self.input.append(int(input("Input: ")))
+                write = self.input.popleft()
+                cell = cells[0] if cells[0] is not None else addr + 1
+                if frame is not None:
+                    frame.pure = False
+            elif op_mode == 4:
+                self.output.append(read(0))
+                if frame is not None:
+                    frame.pure = False
+            elif op_mode in (5, 6):
+                if (read(0) != 0) == (op_mode == 5):
+                    cell = cells[1]
+                    target = params[1] if cell is None else program[cell]
+                    if frame is not None and target == frame.ret and rb == frame.base and cell == frame.ret_slot:
+                        # Return: the return address itself isn't an input of the call
+                        frames.pop()
+                        entry = frame.entry()
+                        if entry is not None:
+                            self.memo.setdefault(frame.target, []).append(entry)
+                        if frames:
+                            frames[-1].merge(frame.reads, frame.writes, frame.max_pos, frame.min_rel, frame.pure)
+                    else:
+                        read(1)
+                        if last_write is not None and last_write[0] == nxt and last_write[1] >= rb:
+                            nxt = self._memo_call(target, rb, nxt, last_write[1], frame)
+                            last_write = None
+                            addr = nxt
+                            continue
+                    nxt = target
+            elif op_mode == 9:
+                self.rel_base += read(0)
             else:
-                self.addr += 3
-
-        elif op_name == "LESS":
-            p1 = self._get_value_addr(1, param_mode_map)
-            p2 = self._get_value_addr(2, param_mode_map)
-            p3 = self._get_value_addr(3, param_mode_map, ret="addr")
-            value = 1 if p1 < p2 else 0
-            self._assign(p3, value)
-            self.addr += 4
-
-        elif op_name == "EQUALS":
-            p1 = self._get_value_addr(1, param_mode_map)
-            p2 = self._get_value_addr(2, param_mode_map)
-            p3 = self._get_value_addr(3, param_mode_map, ret="addr")
-            value = 1 if p1 == p2 else 0
-            self._assign(p3, value)
-            self.addr += 4
-
-        elif op_name == "ADJ_REL":
-            p1 = self._get_value_addr(1, param_mode_map)
-            self.rel_base += p1
-            self.addr += 2
-
-        elif op_name == "END":
-            print("Program reached its end!")
+                print("Program reached its end!")
+                nxt = addr
 
-        else:
-            raise ValueError(f"Invalid op code provided: {op}")
+            last_write = None
+            if write is not None:
+                if frame is not None:
+                    frame.writes[cell] = write
+                last_write = (write, cell)
+                if self._assign(cell, write):
+                    for active in frames:
+                        active.pure = False
+            addr = nxt
+
+            if op_mode in stop_ops and (op_mode in halt_ops or self.status != "RUNNING"):
+                break
+
+        return (addr, op_mode)
+
+    def _memo_call(self, target, base, ret, ret_slot, frame):
+        """
+        Enter a call to target, replaying it from the cache if possible. Returns the next addr.
+        """
+        entry = self._memo_lookup(target, base)
+        if entry is None:
+            self.memo_frames.append(MemoFrame(target, base, ret, ret_slot))
+            if len(self.memo_frames) > self.max_memo_depth:
+                # Calls that never return, give up on the outermost one
+                self.memo_frames.pop(0)
+            return target
 
-        return op_name
+        reads, writes, max_pos, min_rel = entry
+        for relative, cell, value in writes:
+            self._assign(base + cell if relative else cell, value)
+        if frame is not None:
+            frame.merge(
+                {base + cell if relative else cell: value for relative, cell, value in reads},
+                {base + cell if relative else cell: value for relative, cell, value in writes},
+                max_pos,
+                base + min_rel,
+                True,
+            )
+        return ret
 
-    def run(self, pause_on_output=False):
-        exec = True
-        while exec:
-            if self.addr >= len(self.program):
-                raise OverflowError(f"Current address ({self.addr}) exceeds program size ({len(self.program)})")
+    def trace(self, path):
+        """
+        Record every instruction executed by the following run() calls to a binary trace at path
+        until stop_trace(), read it back with TraceReader.
+        """
+        self.stop_trace()
+        self.tracer = TraceWriter(path)
 
-            op_mode, param_mode_map = self._compute_op_code(self.program[self.addr])
-            exec_op = self._execute(op_mode, param_mode_map)
+    def stop_trace(self):
+        if self.tracer is not None:
+            self.tracer.close()
+            self.tracer = None
 
-            if exec_op == "END" or (exec_op == "OUT" and pause_on_output):
-                exec = False
+    def run(self, pause_on_output=False, pause_on_input=False):
+        """
+        Run until the program halts. With pause_on_output, return after each output.
+        With pause_on_input, return with status NEEDS_INPUT instead of prompting on stdin
+        when the input channel is empty; the next run() resumes at that same IN instruction.
+        Pausing watchpoints return with status WATCHPOINT after the instruction that hit them.
+        Machines created with profile=True or tracing run an instrumented loop instead, otherwise
+        machines created with memoize=True run the memoizing loop.
+        """
+        decoded = self.decoded
+        cold_hits = self.cold_hits
+        decode_after = self.decode_after
+        blocks = self.blocks if self.backend == "compiled" else None
+        # Op codes that always stop the loop, and the ones after which status is checked
+        halt_ops = {99}
+        if pause_on_output:
+            halt_ops.add(4)
+        stop_ops = set(halt_ops)
+        if pause_on_input:
+            stop_ops.add(3)
+        watch_pause = any(pause for *_, pause in self.watchpoints)
+        if watch_pause:
+            stop_ops.update(self.op_params)
+        self.pause_on_input = pause_on_input
+        self.status = "RUNNING"
+        addr = self.addr
+        op_mode = None
 
-        result = self.output.copy()
-        self.output = []
+        if self.stats is not None or self.tracer is not None:
+            addr, op_mode = self._run_instrumented(addr, stop_ops, halt_ops)
+        elif self.memoize:
+            addr, op_mode = self._run_memoized(addr, stop_ops, halt_ops)
+        else:
+            while True:
+                if blocks is not None:
+                    block = blocks.get(addr)
+                    if block is None:
+                        block = self._compile_block(addr)
+                    if block:
+                        addr = block(self)
+                        if watch_pause and self.status == "WATCHPOINT":
+                            break
+                        continue
+
+                entry = decoded.get(addr)
+                if entry is not None:
+                    op_mode, handler = entry
+                    addr = handler(self)
+                else:
+                    hits = cold_hits.get(addr, 0)
+                    if hits < decode_after:
+                        # Cold code runs directly until it has proved worth decoding
+                        cold_hits[addr] = hits + 1
+                        op_mode, addr = self._step(addr)
+                    else:
+                        op_mode, handler = self._decode(addr)
+                        addr = handler(self)
+
+                if op_mode in stop_ops and (op_mode in halt_ops or self.status != "RUNNING"):
+                    break
+
+        self.addr = addr
+        if op_mode == 99:
+            self.status = "HALTED"
+        elif op_mode == 4:
+            self.status = "PAUSED"
+        result = list(self.output)
+        self.output.clear()
         return result
 
+    def iter_outputs(self):
+        """
+        Run the program, yielding each output as soon as it is produced without keeping any history.
+        """
+        while True:
+            output = self.run(pause_on_output=True)
+            if not output:
+                return
+            yield from output
+
+    def drive(self, outputs_per_input, callback):
+        """
+        Run a controller-style program: every outputs_per_input outputs are passed to
+        callback(*batch), whose return value is queued as the next input. The machine only
+        returns to Python when it needs input, so each round trip delivers all the outputs of
+        one step together. Driving stops when the program halts, when callback returns None,
+        or when the machine needs input and none was queued.
+
+        Returns the outputs left over that did not complete a batch (or followed the stop).
+        """
+        pending = []
+        while True:
+            outputs = self.run(pause_on_input=True)
+            if pending:
+                outputs = pending + outputs
+            full = len(outputs) - len(outputs) % outputs_per_input
+            for start in range(0, full, outputs_per_input):
+                value = callback(*outputs[start:start + outputs_per_input])
+                if value is None:
+                    return outputs[start + outputs_per_input:]
+                self.input.append(value)
+            pending = outputs[full:]
+            if self.status == "HALTED" or (self.status == "NEEDS_INPUT" and not self.input):
+                return pending
+
     def add_input(self, value):
         self.input.append(value)
 
+    def feed(self, values):
+        self.input.extend(values)
+
+
+class Arcade:
+    """
+    Headless arcade cabinet. play() runs the game to the end, moving the paddle under the ball,
+    with the screen kept as a bytearray of tile ids updated in place from each batch of
+    (x, y, tile) outputs. With a display (a text stream) attached, the first frame is drawn
+    in full and later ones only redraw the tiles that changed, using ANSI cursor moves.
+    """
+
+    tile_chars = " #~=o"
+    tile_table = str.maketrans({chr(tile): char for tile, char in enumerate(tile_chars)})
+
+    def __init__(self, intcode_prog, display=None):
+        self.intcode_prog = intcode_prog
+        self.display = display
+        self.width = 0
+        self.height = 0
+        self.screen = bytearray()
+        self.score = 0
+        self.ball_x = 0
+        self.paddle_x = 0
+        self.frames = 0
+        self.elapsed = 0
+
+    def _resize(self, width, height):
+        screen = bytearray(width * height)
+        for y in range(self.height):
+            screen[y * width:y * width + self.width] = self.screen[y * self.width:(y + 1) * self.width]
+        self.screen, self.width, self.height = screen, width, height
+
+    def _update(self, outputs):
+        """
+        Apply one frame of output triples, returns the (x, y) of every tile that changed.
+        """
+        changed = []
+        outputs = iter(outputs)
+        for x, y, tile in zip(outputs, outputs, outputs):
+            if x == -1 and y == 0:
+                self.score = tile
+                continue
+            if x >= self.width or y >= self.height:
+                self._resize(max(x + 1, self.width), max(y + 1, self.height))
+            pos = y * self.width + x
+            if self.screen[pos] != tile:
+                self.screen[pos] = tile
+                changed.append((x, y))
+            if tile == 4:
+                self.ball_x = x
+            elif tile == 3:
+                self.paddle_x = x
+        return changed
+
+    def render(self):
+        rows = [
+            self.screen[y * self.width:(y + 1) * self.width].decode("latin-1").translate(self.tile_table)
+            for y in range(self.height)
+        ]
+        return "\n".join(rows + [f"Score: {self.score}"])
+
+    def _draw(self, changed, resized):
+        if resized or not self.frames:
+            self.display.write("\x1b[2J\x1b[H" + self.render())
+        else:
+            self.display.write("".join(
+                f"\x1b[{y + 1};{x + 1}H{self.tile_chars[self.screen[y * self.width + x]]}" for x, y in changed
+            ))
+            self.display.write(f"\x1b[{self.height + 1};1HScore: {self.score}")
+        self.display.flush()
+
+    def play(self):
+        """
+        Play until the game ends, returns the final score.
+        """
+        start = time.perf_counter()
+        while True:
+            size = (self.width, self.height)
+            outputs = self.intcode_prog.run(pause_on_input=True)
+            changed = self._update(outputs)
+            if self.display is not None:
+                self._draw(changed, size != (self.width, self.height) and self.frames > 0)
+            self.frames += 1
+            if self.intcode_prog.status == "HALTED":
+                break
+            self.intcode_prog.add_input((self.ball_x > self.paddle_x) - (self.ball_x < self.paddle_x))
+        self.elapsed = time.perf_counter() - start
+        return self.score
+
+    def frames_per_second(self):
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
 
 if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--display"]
     program = "./input"
-    if len(sys.argv) > 1:
-        program = sys.argv[1]
+    if args:
+        program = args[0]
 
+    # Without quarters the game just draws the screen and halts
     intcode_prog = IntCode.from_ext_file(program)
+    intcode_prog.program[0] = 1
+    arcade = Arcade(intcode_prog)
+    arcade.play()
+    print(Counter(arcade.screen))
 
-    results = intcode_prog.run()
-
-    tiles = Counter(results[2::3])
-
-    print(tiles)
+    intcode_prog = IntCode.from_ext_file(program)
+    intcode_prog.program[0] = 2
+    arcade = Arcade(intcode_prog, display=sys.stdout if "--display" in sys.argv else None)
+    score = arcade.play()
+    print(f"\nScore: {score} ({arcade.frames} frames, {arcade.frames_per_second():.0f} frames/s)")
 
 